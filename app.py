@@ -6,27 +6,116 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
-from groq import Groq
+from selenium.webdriver.chromium.remote_connection import ChromiumRemoteConnection
+from selenium.webdriver.remote.client_config import ClientConfig
+from groq import AsyncGroq
+import asyncio
+import concurrent.futures
+import hashlib
+import html
+import httpx
 import os
+import queue
+import re
+import socket
+import threading
 import time
 import uuid
-import json
-import pickle
+import msgpack
+import orjson
+import redis
+import sqlite3
+from collections import OrderedDict
 from datetime import datetime
+from urllib.parse import unquote, urlparse
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'canvas-quiz-bot-secret-key')
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Threading mode: served by gunicorn's gthread worker (see gunicorn.conf.py).
+# With REDIS_URL set, SocketIO events and session routing span every worker.
+socketio = SocketIO(app, async_mode='threading', cors_allowed_origins="*", message_queue=os.environ.get('REDIS_URL'))
 
-# Store active sessions
+# Store active sessions (bots owned by this worker; see SessionRouter)
 active_sessions = {}
 
+# Seconds to wait for the worker that owns a session to answer a routed call
+REMOTE_CALL_TIMEOUT = 300
+
+# One event loop, on its own thread, carries the network I/O of every session.
+# Its to_thread pool runs every session's blocking WebDriver calls, so size it
+# like the request threads (each in-flight solve needs about one) rather than
+# the CPU-based default.
+io_loop = asyncio.new_event_loop()
+io_loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.environ.get('IO_THREADS', os.environ.get('GUNICORN_THREADS', 100))),
+    thread_name_prefix='webdriver'
+))
+threading.Thread(target=io_loop.run_forever, name='io-loop', daemon=True).start()
+
+def run_async(coro):
+    """Run a coroutine on the shared I/O loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, io_loop).result()
+
+# One keep-alive HTTP/2 client for every bot's Groq requests, so concurrent
+# calls share connections instead of each paying a TLS handshake. Only
+# io_loop uses it, which keeps its connections on a single event loop.
+groq_http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    timeout=60
+)
+
+# Connections each WebDriver command client may keep open to chromedriver
+WEBDRIVER_POOL_MAXSIZE = 20
+
+# Option letters used in prompts and answers
+LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+# Essays need the large model; letters and short phrases do not
+GROQ_MODELS = {'essay': 'llama-3.3-70b-versatile'}
+DEFAULT_GROQ_MODEL = 'llama-3.1-8b-instant'
+
+# Completion budget per answer; the letter types leave room for the
+# {"answer": ...} JSON wrapper and its whitespace
+MAX_ANSWER_TOKENS = {
+    'multiple_choice': 16,
+    'multiple_select': 32,
+    'short_answer': 200,
+    'essay': 1000,
+}
+
+# Question types answered through JSON mode when asked one at a time. Short
+# answers stay plain text so a long reply is shortened, not unparseable.
+JSON_ANSWER_TYPES = {'multiple_choice', 'multiple_select'}
+
+# Characters of a streamed essay to collect before each write to the page
+ESSAY_FLUSH_CHARS = 200
+
+# Upper bound on completion tokens for a single batched Groq request
+BATCH_MAX_TOKENS = 8192
+
+# Extra completion tokens per entry of a batched response ({"index": n, ...})
+BATCH_ENTRY_TOKENS = 12
+
+# Per-type instructions for batched prompts (one Groq call per question type)
+BATCH_INSTRUCTIONS = {
+    'multiple_choice': "Answer each of these multiple choice questions. Each answer must be ONLY the letter (A, B, C, D, etc.) of the correct option.",
+    'multiple_select': "Answer each of these multiple select questions. Each answer must be ONLY the letters of ALL correct options separated by commas (e.g., 'A,C,D').",
+    'essay': "Provide a comprehensive essay answer to each of these questions. Each answer must be a detailed, well-structured response.",
+    'short_answer': "Provide a concise, direct answer to each of these questions.",
+    'unknown': "Answer each of these questions.",
+}
+
+# System prompt shared by every Groq answer call
+SYSTEM_PROMPT = "You are a helpful assistant that provides accurate answers to quiz questions. Be concise and precise."
+
 # Configuration management (inspired by bingfarm structure)
 class Config:
     def __init__(self):
         self.config_file = os.path.join('/app', 'config.json')
         self.sessions_file = os.path.join('/app', 'sessions.json')
         self.cookies_dir = os.path.join('/app', 'cookies')
+        self.answers_db = os.path.join('/app', 'answers.db')
         self.data = self.load_config()
         os.makedirs(self.cookies_dir, mode=0o700, exist_ok=True)
     
@@ -38,58 +127,529 @@ class Config:
         }
         if os.path.exists(self.config_file):
             try:
-                with open(self.config_file) as f:
-                    return {**default, **json.load(f)}
+                with open(self.config_file, 'rb') as f:
+                    return {**default, **orjson.loads(f.read())}
             except:
                 return default
         return default
     
     def save(self):
-        with open(self.config_file, 'w') as f:
-            json.dump(self.data, f, indent=2)
+        with open(self.config_file, 'wb') as f:
+            f.write(orjson.dumps(self.data, option=orjson.OPT_INDENT_2))
     
     def get_cookie_path(self, session_id):
-        return os.path.join(self.cookies_dir, f'{session_id}.pkl')
+        return os.path.join(self.cookies_dir, f'{session_id}.msgpack')
 
 config = Config()
 
-class CanvasQuizBot:
-    def __init__(self, groq_api_key, canvas_url):
-        self.groq_client = Groq(api_key=groq_api_key)
-        self.canvas_url = canvas_url
-        self.driver = None
-        self.session_id = str(uuid.uuid4())
+class AnswerCache:
+    """Groq answers keyed by a hash of question type, text and options.
+    
+    Recent entries are kept in an in-memory LRU; everything is persisted to
+    sqlite so repeated quizzes skip Groq across sessions and restarts.
+    Entries expire ttl seconds after they were first stored. The methods
+    block on sqlite, so coroutines call them through asyncio.to_thread.
+    """
+    
+    def __init__(self, db_path, ttl, maxsize=4096):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, answer TEXT, ts REAL)')
+        self._db.commit()
+    
+    @staticmethod
+    def key(question):
+        # Options stay in page order: letter answers are only valid for that order
+        digest = hashlib.blake2b(digest_size=16)
+        for part in [question['type'], question['text'], *(opt['text'] for opt in question['options'])]:
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+    
+    def get_many(self, questions):
+        """Cached answers as {question index: answer}; misses are left out"""
+        keys = {question['index']: self.key(question) for question in questions}
+        oldest = time.time() - self.ttl
+        found = {}
+        with self._lock:
+            for key in set(keys.values()):
+                entry = self._memory.get(key)
+                if entry is not None and entry[1] >= oldest:
+                    self._memory.move_to_end(key)
+                    found[key] = entry[0]
+            
+            missing = [key for key in set(keys.values()) if key not in found]
+            if missing:
+                rows = self._db.execute(
+                    f"SELECT key, answer, ts FROM answers WHERE ts >= ? AND key IN ({','.join('?' * len(missing))})",
+                    (oldest, *missing)
+                ).fetchall()
+                for key, answer, ts in rows:
+                    self._remember(key, answer, ts)
+                    found[key] = answer
         
-    def initialize_browser(self):
-        """Initialize Selenium WebDriver with Chrome - visible in noVNC"""
-        chrome_options = Options()
+        return {index: found[key] for index, key in keys.items() if key in found}
+    
+    def put_many(self, answered):
+        """Store (question, answer) pairs in a single transaction.
         
-        # Configure for X11 display (visible in noVNC)
-        chrome_options.add_argument(f'--display={os.environ.get("DISPLAY", ":99")}')
+        Answers still cached unchanged and fresh keep their original
+        timestamp, so replaying an entry does not extend its lifetime; expired
+        entries are rewritten.
+        """
+        now = time.time()
+        with self._lock:
+            rows = []
+            for question, answer in answered:
+                key = self.key(question)
+                entry = self._memory.get(key)
+                if entry is not None and entry[0] == answer and entry[1] >= now - self.ttl:
+                    continue
+                rows.append((key, answer, now))
+                self._remember(key, answer, now)
+            if rows:
+                with self._db:
+                    self._db.executemany('INSERT OR REPLACE INTO answers (key, answer, ts) VALUES (?, ?, ?)', rows)
+    
+    def _remember(self, key, answer, ts):
+        self._memory[key] = (answer, ts)
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+answer_cache = AnswerCache(
+    config.answers_db,
+    ttl=int(os.environ.get('ANSWER_CACHE_TTL', 30 * 24 * 3600))
+)
+
+# Locators shared by the explicit waits and the extraction script
+QUESTION_SEL = (By.CSS_SELECTOR, ".question, .quiz_question")
+QUESTION_FALLBACK_SEL = (By.CSS_SELECTOR, "[class*='question']")
+SUBMIT_SEL = (By.CSS_SELECTOR, "button[type='submit'], input[type='submit'], .submit_button")
+
+# Runs in the page and returns every question, with its options and input ids,
+# as a JSON string in the shape extract_questions() returns
+EXTRACT_QUESTIONS_JS = """
+function labelFor(input) {
+    // input.labels covers both label[for=id] and a wrapping <label>
+    if (input.labels && input.labels.length) {
+        return input.labels[0].innerText.trim();
+    }
+    const wrapping = input.closest('label');
+    if (wrapping) {
+        return wrapping.innerText.trim();
+    }
+    const parent = input.parentElement;
+    return parent ? parent.innerText.trim() : 'Option';
+}
+
+function option(input) {
+    return {text: labelFor(input), value: input.value, id: input.id};
+}
+
+// arguments[0] is the question container selector; arguments[1], a slow
+// substring match that also hits wrappers and question_text nodes, is only
+// a fallback for pages without the usual classes
+let containers = document.querySelectorAll(arguments[0]);
+if (!containers.length) {
+    containers = document.querySelectorAll(arguments[1]);
+}
+
+const result = [];
+containers.forEach((el, idx) => {
+    const textEl = el.querySelector(".question_text, .text, [class*='question_text']");
+    const text = textEl ? textEl.innerText.trim() : '';
+    if (!text) {
+        return;
+    }
+    
+    const question = {index: idx, text: text, type: 'unknown', options: [], element_id: el.id};
+    
+    // One pass over the question's inputs, bucketed by type
+    const radios = [];
+    const checkboxes = [];
+    let textarea = null;
+    let textInput = null;
+    el.querySelectorAll('input, textarea').forEach(input => {
+        if (input.tagName === 'TEXTAREA') {
+            textarea = textarea || input;
+        } else if (input.type === 'radio') {
+            radios.push(input);
+        } else if (input.type === 'checkbox') {
+            checkboxes.push(input);
+        } else if (input.type === 'text') {
+            textInput = textInput || input;
+        }
+    });
+    
+    // Multiple choice (radio buttons)
+    if (radios.length) {
+        question.type = 'multiple_choice';
+        radios.forEach(r => question.options.push(option(r)));
+    }
+    
+    // Multiple select (checkboxes)
+    if (checkboxes.length) {
+        question.type = 'multiple_select';
+        checkboxes.forEach(c => question.options.push(option(c)));
+    }
+    
+    // Essay question (textarea)
+    if (textarea) {
+        question.type = 'essay';
+        question.input_id = textarea.id;
+    }
+    
+    // Short answer (text input)
+    if (textInput && !radios.length && !checkboxes.length) {
+        question.type = 'short_answer';
+        question.input_id = textInput.id;
+    }
+    
+    result.push(question);
+});
+return JSON.stringify(result);
+"""
+
+# Applies a list of {id, type, value} answer targets in the page. Options are
+# clicked so the page's own handlers run; text inputs get their value set and
+# input/change events dispatched. Returns one success flag per target.
+FILL_ANSWERS_JS = """
+return arguments[0].map(target => {
+    const el = document.getElementById(target.id);
+    if (!el) {
+        return false;
+    }
+    if (target.type === 'click') {
+        if (!el.checked) {
+            el.click();
+        }
+    } else {
+        el.value = target.value;
+        el.dispatchEvent(new Event('input', {bubbles: true}));
+        el.dispatchEvent(new Event('change', {bubbles: true}));
+    }
+    return true;
+});
+"""
+
+# Appends arguments[1] to the value of the input with id arguments[0], or
+# replaces the value when arguments[2] is true. Returns whether it was found.
+WRITE_TEXT_JS = """
+const el = document.getElementById(arguments[0]);
+if (!el) {
+    return false;
+}
+el.value = arguments[2] ? arguments[1] : el.value + arguments[1];
+el.dispatchEvent(new Event('input', {bubbles: true}));
+el.dispatchEvent(new Event('change', {bubbles: true}));
+return true;
+"""
+
+class BrowserPool:
+    """Pre-warmed Chrome instances shared across bot sessions.
+    
+    Sessions check a browser out with acquire() and hand it back with
+    release(), which wipes cookies and storage so the next session starts
+    clean. Headless and visible (noVNC) instances are pooled separately.
+    Instances are recycled after max_uses checkouts.
+    """
+    
+    def __init__(self, size, max_uses):
+        self.size = size
+        self.max_uses = max_uses
+        self._idle = {True: queue.Queue(), False: queue.Queue()}
+        self._uses = {}
+        self._headless = {}
+        self._lock = threading.Lock()
+    
+    def _launch(self, headless):
+        """Start a headless Chrome instance, or one on the X11 display (visible in noVNC)"""
+        chrome_options = Options()
         
-        # Important: Do NOT use headless mode - we want to see it in noVNC!
-        # chrome_options.add_argument('--headless')  # COMMENTED OUT
+        if headless:
+            # Nobody is watching: skip the GPU process, extensions and images
+            chrome_options.add_argument('--headless=new')
+            chrome_options.add_argument('--disable-gpu')
+            chrome_options.add_argument('--disable-extensions')
+            chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+            chrome_options.add_argument('--window-size=1280,720')
+        else:
+            # Configure for X11 display (visible in noVNC)
+            chrome_options.add_argument(f'--display={os.environ.get("DISPLAY", ":99")}')
+            chrome_options.add_argument('--window-size=1920,1080')
+            chrome_options.add_argument('--start-maximized')
         
         chrome_options.add_argument('--no-sandbox')
         chrome_options.add_argument('--disable-dev-shm-usage')
         chrome_options.add_argument('--disable-blink-features=AutomationControlled')
         chrome_options.add_argument('--disable-web-security')
-        chrome_options.add_argument('--window-size=1920,1080')
-        chrome_options.add_argument('--start-maximized')
+        chrome_options.add_argument('--incognito')
         chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
         chrome_options.add_experimental_option('useAutomationExtension', False)
         
         # Use ChromeDriver
         service = Service('/usr/local/bin/chromedriver')
         
-        self.driver = webdriver.Chrome(service=service, options=chrome_options)
-        self.driver.implicitly_wait(10)
+        driver = webdriver.Chrome(service=service, options=chrome_options)
+        
+        # The default command connection has a urllib3 pool of one, which
+        # serializes overlapping WebDriver calls; swap in a wider one
+        default_executor = driver.command_executor
+        driver.command_executor = ChromiumRemoteConnection(
+            remote_server_addr=service.service_url,
+            vendor_prefix='goog',
+            browser_name='chrome',
+            client_config=ClientConfig(
+                remote_server_addr=service.service_url,
+                keep_alive=True,
+                timeout=120,
+                init_args_for_pool_manager={"init_args_for_pool_manager": {"maxsize": WEBDRIVER_POOL_MAXSIZE}}
+            )
+        )
+        default_executor.close()
+        
+        # No implicit wait: lookups that need to wait use WebDriverWait explicitly
+        driver.implicitly_wait(0)
+        return driver
+    
+    def warm(self, headless):
+        """Fill the pool for one browser mode up to its configured size"""
+        while self._idle[headless].qsize() < self.size:
+            try:
+                self._idle[headless].put(self._launch(headless))
+            except Exception as e:
+                print(f"Could not pre-warm browser: {e}")
+                return
+    
+    def acquire(self, headless):
+        """Check out an idle browser, launching one if the pool is empty"""
+        try:
+            driver = self._idle[headless].get_nowait()
+        except queue.Empty:
+            driver = self._launch(headless)
+        
+        with self._lock:
+            self._uses[driver.session_id] = self._uses.get(driver.session_id, 0) + 1
+            self._headless[driver.session_id] = headless
+        return driver
+    
+    def release(self, driver):
+        """Reset a browser and return it to the pool, or retire it"""
+        try:
+            # Close any extra tabs the quiz opened
+            for handle in driver.window_handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(driver.window_handles[0])
+            
+            driver.execute_script("try { localStorage.clear(); sessionStorage.clear(); } catch (e) {}")
+            driver.delete_all_cookies()
+            # delete_all_cookies() only covers the current domain
+            driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+            driver.get('about:blank')
+        except Exception as e:
+            print(f"Could not reset browser: {e}")
+            self._retire(driver)
+            return
+        
+        with self._lock:
+            worn_out = self._uses.get(driver.session_id, 0) >= self.max_uses
+            idle = self._idle[self._headless[driver.session_id]]
+        if worn_out or idle.qsize() >= self.size:
+            self._retire(driver)
+        else:
+            idle.put(driver)
+    
+    def _retire(self, driver):
+        with self._lock:
+            self._uses.pop(driver.session_id, None)
+            self._headless.pop(driver.session_id, None)
+        try:
+            driver.quit()
+        except Exception as e:
+            print(f"Could not quit browser: {e}")
+
+browser_pool = BrowserPool(
+    size=int(os.environ.get('POOL_SIZE', 2)),
+    max_uses=int(os.environ.get('MAX_USES_PER_INSTANCE', 50))
+)
+
+class CanvasAPIClient:
+    """Reads and answers a quiz attempt through the Canvas REST API.
+    
+    Authenticates with the cookies of the browser session that logged in,
+    so Selenium is only needed for login. Callers fall back to the browser
+    on any httpx.HTTPError (e.g. a 401/403 from an instance that does not
+    accept cookie-authenticated API calls).
+    """
+    
+    QUESTION_TYPES = {
+        'multiple_choice_question': 'multiple_choice',
+        'true_false_question': 'multiple_choice',
+        'multiple_answers_question': 'multiple_select',
+        'essay_question': 'essay',
+        'short_answer_question': 'short_answer',
+    }
+    
+    def __init__(self, base_url, course_id, quiz_id, cookies):
+        self.course_id = course_id
+        self.quiz_id = quiz_id
+        self.submission = None
+        
+        jar = httpx.Cookies()
+        headers = {'Accept': 'application/json'}
+        for cookie in cookies:
+            jar.set(cookie['name'], cookie['value'], domain=cookie.get('domain', ''), path=cookie.get('path', '/'))
+            if cookie['name'] == '_csrf_token':
+                # Canvas checks cookie-authenticated writes against this header
+                headers['X-CSRF-Token'] = unquote(cookie['value'])
+        
+        self.http = httpx.AsyncClient(base_url=base_url, cookies=jar, headers=headers, http2=True, timeout=30)
+    
+    @classmethod
+    def for_quiz_url(cls, quiz_url, cookies):
+        """Build a client for a /courses/<id>/quizzes/<id> URL, or None for other pages"""
+        match = re.search(r'/courses/(\d+)/quizzes/(\d+)', quiz_url)
+        if not match:
+            return None
+        parsed = urlparse(quiz_url)
+        return cls(f'{parsed.scheme}://{parsed.netloc}', match.group(1), match.group(2), cookies)
+    
+    async def extract_questions(self):
+        """Questions of the attempt in progress, shaped like extract_questions().
+        
+        Returns None when there is no attempt in progress (one is never
+        started here, since that would use up an attempt) or when a question
+        comes back without a type or text to answer from.
+        """
+        resp = await self.http.get(f'/api/v1/courses/{self.course_id}/quizzes/{self.quiz_id}/submission')
+        resp.raise_for_status()
+        submissions = resp.json().get('quiz_submissions', [])
+        in_progress = [sub for sub in submissions if sub.get('workflow_state') == 'untaken']
+        if not in_progress:
+            return None
+        self.submission = in_progress[0]
+        
+        resp = await self.http.get(
+            f"/api/v1/quiz_submissions/{self.submission['id']}/questions",
+            params={'include[]': 'quiz_question'}
+        )
+        resp.raise_for_status()
+        data = resp.json()
+        # Depending on the Canvas version the included quiz_question is merged
+        # into each item, nested under it, or side-loaded alongside
+        side_loaded = {q.get('id'): q for q in data.get('quiz_questions') or []}
+        
+        questions = []
+        for idx, item in enumerate(data.get('quiz_submission_questions', [])):
+            fields = {
+                **side_loaded.get(item.get('quiz_question_id', item['id']), {}),
+                **(item.get('quiz_question') or {}),
+                **{key: value for key, value in item.items() if value}
+            }
+            text = _html_to_text(fields.get('question_text') or '')
+            if not text or not fields.get('question_type'):
+                print(f"Canvas API returned question {item['id']} without its type or text")
+                return None
+            questions.append({
+                'index': idx,
+                'text': text,
+                'type': self.QUESTION_TYPES.get(fields['question_type'], 'unknown'),
+                'options': [
+                    {
+                        'text': opt.get('text') or _html_to_text(opt.get('html', '')),
+                        'value': opt['id'],
+                        'id': opt['id']
+                    }
+                    for opt in fields.get('answers') or []
+                ],
+                'element_id': f"question_{item['id']}",
+                'question_id': item['id']
+            })
+        return questions
+    
+    async def submit_answers(self, answered):
+        """Save (question, targets) pairs on the attempt; returns {question index: filled}"""
+        quiz_questions = []
+        for question, targets in answered:
+            if question['type'] == 'multiple_choice':
+                answer = targets[0]['id']
+            elif question['type'] == 'multiple_select':
+                answer = [target['id'] for target in targets]
+            else:
+                answer = targets[0]['value']
+            quiz_questions.append({'id': question['question_id'], 'answer': answer})
+        
+        resp = await self.http.post(f"/api/v1/quiz_submissions/{self.submission['id']}/questions", json={
+            'attempt': self.submission['attempt'],
+            'validation_token': self.submission['validation_token'],
+            'quiz_questions': quiz_questions
+        })
+        resp.raise_for_status()
+        return {question['index']: True for question, _ in answered}
+    
+    async def complete(self):
+        """Turn in the attempt"""
+        resp = await self.http.post(
+            f"/api/v1/courses/{self.course_id}/quizzes/{self.quiz_id}/submissions/{self.submission['id']}/complete",
+            json={
+                'attempt': self.submission['attempt'],
+                'validation_token': self.submission['validation_token']
+            }
+        )
+        resp.raise_for_status()
+    
+    async def aclose(self):
+        await self.http.aclose()
+
+def _format_options(options):
+    """Lettered option list for a prompt ("A. ...", one per line)"""
+    return "\n".join(f"{letter}. {opt['text']}" for letter, opt in zip(LETTERS, options))
+
+def _json_answer(value):
+    """Answer text from a JSON-mode reply value (lists become "A,C")"""
+    if isinstance(value, list):
+        return ','.join(str(item).strip() for item in value)
+    return str(value).strip()
+
+def _groq_messages(prompt, json_reply=False):
+    """Chat messages for an answer prompt, asking for JSON when json_reply is set"""
+    system = SYSTEM_PROMPT + " Always respond with valid JSON." if json_reply else SYSTEM_PROMPT
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": prompt}
+    ]
+
+def _html_to_text(markup):
+    """Plain text of a Canvas HTML fragment"""
+    return ' '.join(html.unescape(re.sub(r'<[^>]+>', ' ', markup)).split())
+
+class CanvasQuizBot:
+    def __init__(self, groq_api_key, canvas_url, headless=True):
+        self.async_groq = AsyncGroq(api_key=groq_api_key, http_client=groq_http_client)
+        self.canvas_url = canvas_url
+        self.headless = headless
+        # Serializes page writes from concurrent answer streams on the one tab
+        self._dom_lock = asyncio.Lock()
+        self.driver = None
+        self._wait = None
+        self.canvas_api = None
+        self.session_id = str(uuid.uuid4())
+        
+    def initialize_browser(self):
+        """Check out a warm Chrome instance from the pool (visible in noVNC unless headless)"""
+        self.driver = browser_pool.acquire(self.headless)
+        self._wait = WebDriverWait(self.driver, 10)
         
         # Send browser startup notification via SocketIO
         try:
             socketio.emit('browser_started', {
                 'session_id': self.session_id,
-                'message': 'Browser launched! Check noVNC viewer.'
+                'message': 'Browser launched (headless).' if self.headless else 'Browser launched! Check noVNC viewer.'
             })
         except:
             pass
@@ -102,149 +662,96 @@ class CanvasQuizBot:
             raise Exception("Browser not initialized")
         
         self.driver.get(self.canvas_url)
-        time.sleep(3)  # Wait for page load
+        # Wait for the page to finish loading (extract_questions waits for the questions themselves)
+        WebDriverWait(self.driver, 15).until(
+            lambda d: d.execute_script("return document.readyState") == "complete"
+        )
         return True
     
     def extract_questions(self):
         """Extract all questions from the Canvas quiz page"""
-        questions = []
-        
         try:
             # Wait for quiz questions to load
-            WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, ".question, .quiz_question"))
-            )
+            # Either the usual containers or, failing those, the substring fallback
+            self._wait.until(EC.any_of(
+                EC.presence_of_element_located(QUESTION_SEL),
+                EC.presence_of_element_located(QUESTION_FALLBACK_SEL)
+            ))
             
-            # Find all question containers
-            question_elements = self.driver.find_elements(By.CSS_SELECTOR, ".question, .quiz_question, [class*='question']")
-            
-            for idx, question_el in enumerate(question_elements):
-                try:
-                    # Extract question text
-                    question_text_el = question_el.find_element(By.CSS_SELECTOR, ".question_text, .text, [class*='question_text']")
-                    question_text = question_text_el.text.strip()
-                    
-                    if not question_text:
-                        continue
-                    
-                    question_data = {
-                        'index': idx,
-                        'text': question_text,
-                        'type': 'unknown',
-                        'options': [],
-                        'element_id': question_el.get_attribute('id')
-                    }
-                    
-                    # Detect question type and extract options
-                    # Multiple choice (radio buttons)
-                    radio_inputs = question_el.find_elements(By.CSS_SELECTOR, "input[type='radio']")
-                    if radio_inputs:
-                        question_data['type'] = 'multiple_choice'
-                        for radio in radio_inputs:
-                            label = self._find_label_for_input(radio)
-                            question_data['options'].append({
-                                'text': label,
-                                'value': radio.get_attribute('value'),
-                                'id': radio.get_attribute('id')
-                            })
-                    
-                    # Multiple select (checkboxes)
-                    checkbox_inputs = question_el.find_elements(By.CSS_SELECTOR, "input[type='checkbox']")
-                    if checkbox_inputs:
-                        question_data['type'] = 'multiple_select'
-                        for checkbox in checkbox_inputs:
-                            label = self._find_label_for_input(checkbox)
-                            question_data['options'].append({
-                                'text': label,
-                                'value': checkbox.get_attribute('value'),
-                                'id': checkbox.get_attribute('id')
-                            })
-                    
-                    # Essay question (textarea)
-                    textarea = question_el.find_elements(By.CSS_SELECTOR, "textarea")
-                    if textarea:
-                        question_data['type'] = 'essay'
-                        question_data['input_id'] = textarea[0].get_attribute('id')
-                    
-                    # Short answer (text input)
-                    text_input = question_el.find_elements(By.CSS_SELECTOR, "input[type='text']")
-                    if text_input and not radio_inputs and not checkbox_inputs:
-                        question_data['type'] = 'short_answer'
-                        question_data['input_id'] = text_input[0].get_attribute('id')
-                    
-                    questions.append(question_data)
-                    
-                except Exception as e:
-                    print(f"Error extracting question {idx}: {str(e)}")
-                    continue
-            
-            return questions
+            # Walk the DOM in-page so the whole quiz costs one WebDriver round trip
+            return orjson.loads(self.driver.execute_script(
+                EXTRACT_QUESTIONS_JS, QUESTION_SEL[1], QUESTION_FALLBACK_SEL[1]
+            ))
             
         except Exception as e:
             print(f"Error extracting questions: {str(e)}")
             return []
     
-    def _find_label_for_input(self, input_element):
-        """Find the label text for an input element"""
-        try:
-            # Try to find parent label
-            parent = input_element.find_element(By.XPATH, "./..")
-            if parent.tag_name.lower() == 'label':
-                return parent.text.strip()
-            
-            # Try to find label by 'for' attribute
-            input_id = input_element.get_attribute('id')
-            if input_id:
-                label = self.driver.find_element(By.CSS_SELECTOR, f"label[for='{input_id}']")
-                return label.text.strip()
-            
-            # Try to find nearby text
-            return parent.text.strip()
-        except:
-            return "Option"
-    
-    def get_answer_from_groq(self, question):
+    async def get_answer_from_groq(self, question):
         """Get answer from Groq API"""
         try:
+            q_type = question['type']
             prompt = self._build_prompt(question)
+            options = {}
+            if q_type in JSON_ANSWER_TYPES:
+                # JSON mode keeps the reply to the answer itself, no explanation
+                prompt += '\n\nRespond with a JSON object of the form {"answer": "<answer>"}.'
+                options['response_format'] = {"type": "json_object"}
             
-            completion = self.groq_client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant that provides accurate answers to quiz questions. Be concise and precise."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                model="llama-3.3-70b-versatile",
+            completion = await self.async_groq.chat.completions.create(
+                messages=_groq_messages(prompt),
+                model=GROQ_MODELS.get(q_type, DEFAULT_GROQ_MODEL),
                 temperature=0.3,
-                max_tokens=1000 if question['type'] == 'essay' else 200
+                max_tokens=MAX_ANSWER_TOKENS.get(q_type, 200),
+                **options
             )
             
             answer = completion.choices[0].message.content.strip()
+            if q_type in JSON_ANSWER_TYPES:
+                answer = _json_answer(orjson.loads(answer)['answer'])
             return answer
             
         except Exception as e:
             print(f"Groq API error: {str(e)}")
             raise e
     
+    async def get_answers_batch(self, questions):
+        """Get answers for several questions of the same type in one Groq call"""
+        q_type = questions[0]['type']
+        prompt = self._build_batch_prompt(questions)
+        per_question_tokens = MAX_ANSWER_TOKENS.get(q_type, 200) + BATCH_ENTRY_TOKENS
+        
+        completion = await self.async_groq.chat.completions.create(
+            messages=_groq_messages(prompt, json_reply=True),
+            model=GROQ_MODELS.get(q_type, DEFAULT_GROQ_MODEL),
+            temperature=0.3,
+            max_tokens=min(per_question_tokens * len(questions), BATCH_MAX_TOKENS),
+            response_format={"type": "json_object"}
+        )
+        
+        return self._parse_batch_answers(completion.choices[0].message.content, questions)
+    
+    def _parse_batch_answers(self, content, questions):
+        """Map a batch JSON response to {question index: answer}"""
+        expected = {q['index'] for q in questions}
+        answers = {}
+        for item in orjson.loads(content)['answers']:
+            index = int(item['index'])
+            answer = _json_answer(item['answer'])
+            if index in expected and answer:
+                answers[index] = answer
+        return answers
+    
     def _build_prompt(self, question):
         """Build appropriate prompt based on question type"""
         q_type = question['type']
         q_text = question['text']
         
         if q_type == 'multiple_choice':
-            prompt = f"Answer this multiple choice question. Return ONLY the letter (A, B, C, D, etc.) of the correct answer, nothing else.\n\nQuestion: {q_text}\n\nOptions:\n"
-            for idx, opt in enumerate(question['options']):
-                prompt += f"{chr(65 + idx)}. {opt['text']}\n"
+            prompt = f"Answer this multiple choice question. Return ONLY the letter (A, B, C, D, etc.) of the correct answer, nothing else.\n\nQuestion: {q_text}\n\nOptions:\n{_format_options(question['options'])}"
         
         elif q_type == 'multiple_select':
-            prompt = f"Answer this multiple select question. Return ONLY the letters (e.g., 'A,C,D') of ALL correct answers separated by commas, nothing else.\n\nQuestion: {q_text}\n\nOptions:\n"
-            for idx, opt in enumerate(question['options']):
-                prompt += f"{chr(65 + idx)}. {opt['text']}\n"
+            prompt = f"Answer this multiple select question. Return ONLY the letters (e.g., 'A,C,D') of ALL correct answers separated by commas, nothing else.\n\nQuestion: {q_text}\n\nOptions:\n{_format_options(question['options'])}"
         
         elif q_type == 'essay':
             prompt = f"Provide a comprehensive essay answer to this question:\n\n{q_text}\n\nWrite a detailed, well-structured response."
@@ -257,84 +764,308 @@ class CanvasQuizBot:
         
         return prompt
     
-    def fill_answer(self, question, answer):
-        """Fill in the answer on the page"""
-        try:
-            q_type = question['type']
+    def _build_batch_prompt(self, questions):
+        """Build one prompt enumerating every question of a single type"""
+        instruction = BATCH_INSTRUCTIONS.get(questions[0]['type'], BATCH_INSTRUCTIONS['unknown'])
+        lines = [
+            f"{instruction}",
+            'Respond with a JSON object of the form {"answers": [{"index": 0, "answer": "B"}]} '
+            'containing exactly one entry per question, using the question numbers given below as "index".',
+        ]
+        for question in questions:
+            lines.append(f"\nQuestion {question['index']}: {question['text']}")
+            if question['options']:
+                lines.append("Options:")
+                lines.append(_format_options(question['options']))
+        return "\n".join(lines)
+    
+    def _answer_targets(self, question, answer):
+        """Translate an answer into the page inputs it sets.
+        
+        Returns a list of {'id', 'type', 'value'} entries, or None when the
+        answer cannot be applied to this question.
+        """
+        q_type = question['type']
+        
+        if q_type == 'multiple_choice':
+            # Parse answer letter
+            answer_letter = answer[0].upper() if answer else None
+            if not answer_letter:
+                return None
             
-            if q_type == 'multiple_choice':
-                # Parse answer letter
-                answer_letter = answer[0].upper() if answer else None
-                if not answer_letter:
-                    return False
-                
-                option_index = ord(answer_letter) - 65
+            option_index = LETTERS.find(answer_letter)
+            if 0 <= option_index < len(question['options']):
+                return [{'id': question['options'][option_index]['id'], 'type': 'click', 'value': None}]
+            return None
+        
+        elif q_type == 'multiple_select':
+            # Parse answer letters
+            targets = []
+            for letter in answer.split(','):
+                letter = letter.strip().upper()
+                option_index = LETTERS.find(letter) if len(letter) == 1 else -1
                 if 0 <= option_index < len(question['options']):
-                    option = question['options'][option_index]
-                    element = self.driver.find_element(By.ID, option['id'])
-                    element.click()
-                    return True
-            
-            elif q_type == 'multiple_select':
-                # Parse answer letters
-                answer_letters = [l.strip().upper() for l in answer.split(',')]
-                for letter in answer_letters:
-                    option_index = ord(letter) - 65
-                    if 0 <= option_index < len(question['options']):
-                        option = question['options'][option_index]
-                        element = self.driver.find_element(By.ID, option['id'])
-                        element.click()
-                return True
+                    targets.append({'id': question['options'][option_index]['id'], 'type': 'click', 'value': None})
+            return targets
+        
+        elif q_type in ['essay', 'short_answer']:
+            return [{'id': question.get('input_id'), 'type': 'text', 'value': answer}]
+        
+        return None
+    
+    def fill_answers(self, answered):
+        """Fill every (question, answer) pair on the page in one script call.
+        
+        Returns {question index: filled}.
+        """
+        filled = {}
+        payload = []
+        for question, answer in answered:
+            targets = self._answer_targets(question, answer)
+            if not targets:
+                filled[question['index']] = False
+                continue
+            filled[question['index']] = True
+            for target in targets:
+                payload.append({**target, 'question': question['index']})
+        
+        if not payload:
+            return filled
+        
+        try:
+            applied = self.driver.execute_script(FILL_ANSWERS_JS, payload)
+            for target, ok in zip(payload, applied):
+                if not ok:
+                    filled[target['question']] = False
+        except Exception as e:
+            print(f"Error filling answers: {str(e)}")
+            for target in payload:
+                filled[target['question']] = False
+        
+        return filled
+    
+    async def answer_questions(self, questions):
+        """Answer questions with one batched Groq call per question type.
+        
+        Previously seen questions are served from the answer cache (the
+        caller stores new answers once it knows they apply). The
+        per-type batches run concurrently. Returns {question index:
+        answer or Exception}; questions the batch responses fail to cover
+        fall back to individual requests, also issued concurrently.
+        """
+        answers = await asyncio.to_thread(answer_cache.get_many, questions)
+        fresh = [q for q in questions if q['index'] not in answers]
+        
+        by_type = {}
+        for question in fresh:
+            by_type.setdefault(question['type'], []).append(question)
+        
+        batches = await asyncio.gather(
+            *[self.get_answers_batch(group) for group in by_type.values()],
+            return_exceptions=True
+        )
+        for q_type, batch in zip(by_type, batches):
+            if isinstance(batch, Exception):
+                print(f"Batch answer error ({q_type}): {str(batch)}")
+            else:
+                answers.update(batch)
+        
+        missing = [q for q in questions if q['index'] not in answers]
+        fallback = await asyncio.gather(
+            *[self.get_answer_from_groq(q) for q in missing],
+            return_exceptions=True
+        )
+        for question, answer in zip(missing, fallback):
+            answers[question['index']] = answer
+        
+        return answers
+    
+    async def _answer_and_fill(self, questions):
+        """Answer questions through the batched path, then fill them in one pass"""
+        answers = await self.answer_questions(questions)
+        async with self._dom_lock:
+            filled = await asyncio.to_thread(self.fill_answers, [
+                (q, answers[q['index']]) for q in questions
+                if not isinstance(answers[q['index']], Exception)
+            ])
+        return answers, filled
+    
+    async def stream_essay(self, question):
+        """Stream an essay answer from Groq into its textarea as it is generated.
+        
+        Text is pushed to the page in batches of ESSAY_FLUSH_CHARS, and the
+        final write replaces the field with the complete, stripped answer.
+        Returns (answer or Exception, filled).
+        """
+        input_id = question['input_id']
+        try:
+            stream = await self.async_groq.chat.completions.create(
+                messages=_groq_messages(self._build_prompt(question)),
+                model=GROQ_MODELS['essay'],
+                temperature=0.3,
+                max_tokens=MAX_ANSWER_TOKENS['essay'],
+                stream=True
+            )
             
-            elif q_type in ['essay', 'short_answer']:
-                element = self.driver.find_element(By.ID, question['input_id'])
-                element.clear()
-                element.send_keys(answer)
-                return True
+            filled = await self._write_text(input_id, '', replace=True)
+            parts = []
+            pending = ''
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ''
+                parts.append(delta)
+                pending += delta
+                if len(pending) >= ESSAY_FLUSH_CHARS:
+                    filled = await self._write_text(input_id, pending) and filled
+                    pending = ''
             
-            return False
+            answer = ''.join(parts).strip()
+            filled = await self._write_text(input_id, answer, replace=True) and filled
+            return answer, filled
             
         except Exception as e:
-            print(f"Error filling answer: {str(e)}")
+            print(f"Groq API error: {str(e)}")
+            return e, False
+    
+    async def _write_text(self, input_id, text, replace=False):
+        """Append text to (or replace the value of) a page input"""
+        try:
+            async with self._dom_lock:
+                return await asyncio.to_thread(self.driver.execute_script, WRITE_TEXT_JS, input_id, text, replace)
+        except Exception as e:
+            print(f"Error writing answer text: {str(e)}")
             return False
     
-    def solve_quiz(self, auto_submit=False):
-        """Solve all questions in the quiz"""
-        questions = self.extract_questions()
+    async def _canvas_api(self):
+        """The Canvas API client for this session, built from the browser's cookies"""
+        if self.canvas_api is None:
+            cookies = await asyncio.to_thread(self.driver.get_cookies)
+            self.canvas_api = CanvasAPIClient.for_quiz_url(self.canvas_url, cookies)
+        return self.canvas_api
+    
+    async def _drop_canvas_api(self, error):
+        print(f"Canvas API unavailable, using the browser: {str(error)}")
+        if self.canvas_api is not None:
+            await self.canvas_api.aclose()
+            self.canvas_api = None
+    
+    async def load_questions(self):
+        """Quiz questions from the Canvas API when possible, else from the page.
+        
+        Returns (questions, via_api).
+        """
+        api = await self._canvas_api()
+        if api is not None:
+            try:
+                questions = await api.extract_questions()
+                if questions:
+                    return questions, True
+            except httpx.HTTPError as e:
+                await self._drop_canvas_api(e)
+        return await asyncio.to_thread(self.extract_questions), False
+    
+    async def _solve_via_api(self, questions, auto_submit):
+        """Answer and save an attempt over the Canvas API; None if the API refuses"""
+        answers = await self.answer_questions(questions)
+        filled = {}
+        answered = []
+        for question in questions:
+            answer = answers[question['index']]
+            targets = None if isinstance(answer, Exception) else self._answer_targets(question, answer)
+            filled[question['index']] = bool(targets)
+            if targets:
+                answered.append((question, targets))
+        
+        try:
+            if answered:
+                filled.update(await self.canvas_api.submit_answers(answered))
+            if auto_submit:
+                await self.canvas_api.complete()
+        except httpx.HTTPError as e:
+            await self._drop_canvas_api(e)
+            return None
+        
+        # Reload so the browser (and noVNC) shows the saved answers
+        await asyncio.to_thread(self.driver.refresh)
+        return answers, filled
+    
+    async def _solve_in_page(self, questions, auto_submit):
+        """Answer questions read from the page and fill them in the browser"""
+        # Uncached essays stream straight into their textarea; the rest are batched
+        essays = [q for q in questions if q['type'] == 'essay' and q.get('input_id')]
+        cached = await asyncio.to_thread(answer_cache.get_many, essays)
+        streamed = [q for q in essays if q['index'] not in cached]
+        streamed_indexes = {q['index'] for q in streamed}
+        batched = [q for q in questions if q['index'] not in streamed_indexes]
+        
+        (answers, filled), essays = await asyncio.gather(
+            self._answer_and_fill(batched),
+            asyncio.gather(*[self.stream_essay(q) for q in streamed])
+        )
+        for question, (answer, essay_filled) in zip(streamed, essays):
+            answers[question['index']] = answer
+            filled[question['index']] = essay_filled
+        
+        # Auto-submit if requested
+        if auto_submit:
+            await asyncio.to_thread(self.submit_quiz)
+        
+        return answers, filled
+    
+    async def solve_quiz(self, auto_submit=False):
+        """Solve all questions in the quiz.
+        
+        Uses the Canvas API when it accepts the session, otherwise the page.
+        Runs on the shared I/O loop; blocking WebDriver calls are pushed to
+        worker threads so other sessions' Groq requests keep moving.
+        """
+        questions, via_api = await self.load_questions()
+        solved = None
+        if via_api:
+            solved = await self._solve_via_api(questions, auto_submit)
+            if solved is None:
+                questions = await asyncio.to_thread(self.extract_questions)
+        if solved is None:
+            solved = await self._solve_in_page(questions, auto_submit)
+        answers, filled = solved
+        
+        # Only remember answers that could be applied to their question
+        await asyncio.to_thread(answer_cache.put_many, [
+            (q, answers[q['index']]) for q in questions
+            if not isinstance(answers[q['index']], Exception)
+            and self._answer_targets(q, answers[q['index']])
+        ])
+        
         results = []
         
         for question in questions:
-            try:
-                answer = self.get_answer_from_groq(question)
-                filled = self.fill_answer(question, answer)
-                
+            answer = answers[question['index']]
+            if isinstance(answer, Exception):
                 results.append({
                     'question_index': question['index'],
                     'question_text': question['text'],
-                    'question_type': question['type'],
-                    'answer': answer,
-                    'filled': filled
+                    'error': str(answer)
                 })
-                
-                time.sleep(0.5)  # Small delay between questions
-                
-            except Exception as e:
+            else:
                 results.append({
                     'question_index': question['index'],
                     'question_text': question['text'],
-                    'error': str(e)
+                    'question_type': question['type'],
+                    'answer': answer,
+                    'filled': filled[question['index']]
                 })
         
-        # Auto-submit if requested
-        if auto_submit:
-            try:
-                submit_button = self.driver.find_element(By.CSS_SELECTOR, "button[type='submit'], input[type='submit'], .submit_button")
-                submit_button.click()
-            except Exception as e:
-                print(f"Auto-submit error: {str(e)}")
-        
         return results
     
+    def submit_quiz(self):
+        """Click the quiz submit button"""
+        try:
+            submit_button = self._wait.until(EC.element_to_be_clickable(SUBMIT_SEL))
+            submit_button.click()
+        except Exception as e:
+            print(f"Auto-submit error: {str(e)}")
+    
     def close(self):
         """Close the browser and save session"""
         if self.driver:
@@ -342,12 +1073,17 @@ class CanvasQuizBot:
             try:
                 cookie_path = config.get_cookie_path(self.session_id)
                 with open(cookie_path, 'wb') as f:
-                    pickle.dump(self.driver.get_cookies(), f)
+                    f.write(msgpack.packb(self.driver.get_cookies()))
             except Exception as e:
                 print(f"Could not save cookies: {e}")
             
-            self.driver.quit()
+            browser_pool.release(self.driver)
             self.driver = None
+            self._wait = None
+        
+        if self.canvas_api is not None:
+            run_async(self.canvas_api.aclose())
+            self.canvas_api = None
     
     def restore_session(self):
         """Restore previous session from cookies"""
@@ -361,7 +1097,7 @@ class CanvasQuizBot:
             
             # Load cookies
             with open(cookie_path, 'rb') as f:
-                cookies = pickle.load(f)
+                cookies = msgpack.unpackb(f.read(), raw=False)
             
             for cookie in cookies:
                 try:
@@ -376,6 +1112,173 @@ class CanvasQuizBot:
             return False
 
 
+class SessionNotFound(Exception):
+    pass
+
+class SessionRouter:
+    """Routes session operations to the worker process that owns the bot.
+    
+    A bot and its browser live in the process that started them. Without
+    REDIS_URL that is the only process and calls run locally. With it, each
+    worker records the sessions it owns in the bot:sessions hash and listens
+    on its own bot:<worker> channel; a call for a session owned elsewhere is
+    published to the owner and the caller waits for the reply on its
+    bot:<worker>:replies channel.
+    """
+    
+    def __init__(self, redis_url, worker_id):
+        self.worker_id = worker_id
+        self.redis = redis.Redis.from_url(redis_url, decode_responses=True) if redis_url else None
+        self._pending = {}
+        self._lock = threading.Lock()
+    
+    @property
+    def _requests_channel(self):
+        return f'bot:{self.worker_id}'
+    
+    @property
+    def _replies_channel(self):
+        return f'bot:{self.worker_id}:replies'
+    
+    def start(self):
+        """Start listening for calls from other workers"""
+        if self.redis is not None:
+            socketio.start_background_task(self._listen)
+    
+    def register(self, bot):
+        active_sessions[bot.session_id] = bot
+        if self.redis is not None:
+            self.redis.hset('bot:sessions', bot.session_id, self.worker_id)
+    
+    def unregister(self, session_id):
+        active_sessions.pop(session_id, None)
+        if self.redis is not None:
+            self.redis.hdel('bot:sessions', session_id)
+    
+    def count(self):
+        """Number of active sessions across all workers"""
+        if self.redis is not None:
+            self._prune_dead_workers()
+            return self.redis.hlen('bot:sessions')
+        return len(active_sessions)
+    
+    def _prune_dead_workers(self):
+        """Drop sessions whose owner no longer listens on its channel"""
+        owners = self.redis.hgetall('bot:sessions')
+        workers = set(owners.values())
+        if not workers:
+            return
+        listening = dict(self.redis.pubsub_numsub(*[f'bot:{worker}' for worker in workers]))
+        dead = [
+            session_id for session_id, worker in owners.items()
+            if not listening.get(f'bot:{worker}')
+        ]
+        if dead:
+            self.redis.hdel('bot:sessions', *dead)
+    
+    def call(self, session_id, op, *args):
+        """Run a session operation wherever the session lives"""
+        if not session_id or not isinstance(session_id, str):
+            raise SessionNotFound(session_id)
+        if session_id in active_sessions or self.redis is None:
+            return self._run_local(session_id, op, args)
+        
+        owner = self.redis.hget('bot:sessions', session_id)
+        if owner is None:
+            raise SessionNotFound(session_id)
+        
+        request_id = str(uuid.uuid4())
+        future = concurrent.futures.Future()
+        with self._lock:
+            self._pending[request_id] = future
+        try:
+            receivers = self.redis.publish(f'bot:{owner}', orjson.dumps({
+                'request_id': request_id,
+                'reply_to': self.worker_id,
+                'session_id': session_id,
+                'op': op,
+                'args': args
+            }))
+            if not receivers:
+                # Nobody listens on the owner's channel: that worker is gone
+                self.redis.hdel('bot:sessions', session_id)
+                raise SessionNotFound(session_id)
+            reply = future.result(timeout=REMOTE_CALL_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            raise Exception(f"Worker {owner} did not answer for session {session_id}")
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+        
+        if reply.get('not_found'):
+            raise SessionNotFound(session_id)
+        if 'error' in reply:
+            raise Exception(reply['error'])
+        return reply['result']
+    
+    def _run_local(self, session_id, op, args):
+        bot = active_sessions.get(session_id)
+        if bot is None:
+            raise SessionNotFound(session_id)
+        
+        if op == 'navigate':
+            return bot.navigate_to_quiz()
+        if op == 'extract_questions':
+            return run_async(bot.load_questions())[0]
+        if op == 'solve_quiz':
+            return run_async(bot.solve_quiz(*args))
+        if op == 'close':
+            bot.close()
+            self.unregister(session_id)
+            return None
+        raise ValueError(f"Unknown session operation: {op}")
+    
+    def _listen(self):
+        """Serve routed calls and replies, resubscribing after any error"""
+        while True:
+            try:
+                pubsub = self.redis.pubsub()
+                pubsub.subscribe(self._requests_channel, self._replies_channel)
+                # Other workers may have pruned our sessions while we were away
+                for session_id in list(active_sessions):
+                    self.redis.hset('bot:sessions', session_id, self.worker_id)
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self._dispatch(message)
+            except Exception as e:
+                print(f"Session router listener error, resubscribing: {e}")
+                time.sleep(1)
+    
+    def _dispatch(self, message):
+        try:
+            payload = orjson.loads(message['data'])
+            if message['channel'] == self._replies_channel:
+                with self._lock:
+                    future = self._pending.get(payload['request_id'])
+                if future is not None:
+                    future.set_result(payload)
+            else:
+                socketio.start_background_task(self._serve, payload)
+        except Exception as e:
+            print(f"Dropping bad session router message: {e}")
+    
+    def _serve(self, payload):
+        """Run a call published by another worker and send back the result"""
+        reply = {'request_id': payload['request_id']}
+        try:
+            reply['result'] = self._run_local(payload['session_id'], payload['op'], payload['args'])
+        except SessionNotFound:
+            reply['not_found'] = True
+        except Exception as e:
+            reply['error'] = str(e)
+        self.redis.publish(f"bot:{payload['reply_to']}:replies", orjson.dumps(reply))
+
+session_router = SessionRouter(
+    os.environ.get('REDIS_URL'),
+    worker_id=f'{socket.gethostname()}:{os.getpid()}'
+)
+
+
 # Flask routes
 @app.route('/')
 def index():
@@ -401,7 +1304,7 @@ def novnc_direct():
 def health_check():
     return jsonify({
         'status': 'healthy',
-        'active_sessions': len(active_sessions),
+        'active_sessions': session_router.count(),
         'novnc_available': True,
         'novnc_port': 6080
     })
@@ -414,7 +1317,7 @@ def handle_connect():
 @socketio.on('request_status')
 def handle_status_request():
     emit('status_update', {
-        'active_sessions': len(active_sessions),
+        'active_sessions': session_router.count(),
         'novnc_url': f'http://localhost:6080/vnc.html'
     })
 
@@ -424,16 +1327,20 @@ def start_session():
         data = request.json
         api_key = data.get('apiKey')
         canvas_url = data.get('canvasUrl')
+        headless = data.get('headless', config.data['headless'])
         
         if not api_key or not canvas_url:
             return jsonify({'error': 'API key and Canvas URL are required'}), 400
         
+        if not isinstance(headless, bool):
+            return jsonify({'error': 'headless must be true or false'}), 400
+        
         # Create new bot instance
-        bot = CanvasQuizBot(api_key, canvas_url)
+        bot = CanvasQuizBot(api_key, canvas_url, headless=headless)
         bot.initialize_browser()
         
         # Store session
-        active_sessions[bot.session_id] = bot
+        session_router.register(bot)
         
         return jsonify({
             'sessionId': bot.session_id,
@@ -449,14 +1356,12 @@ def navigate():
         data = request.json
         session_id = data.get('sessionId')
         
-        if session_id not in active_sessions:
-            return jsonify({'error': 'Session not found'}), 404
-        
-        bot = active_sessions[session_id]
-        bot.navigate_to_quiz()
+        session_router.call(session_id, 'navigate')
         
         return jsonify({'message': 'Navigated to Canvas page'})
         
+    except SessionNotFound:
+        return jsonify({'error': 'Session not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -466,11 +1371,7 @@ def extract_questions():
         data = request.json
         session_id = data.get('sessionId')
         
-        if session_id not in active_sessions:
-            return jsonify({'error': 'Session not found'}), 404
-        
-        bot = active_sessions[session_id]
-        questions = bot.extract_questions()
+        questions = session_router.call(session_id, 'extract_questions')
         
         # Format questions for response
         formatted_questions = []
@@ -487,6 +1388,8 @@ def extract_questions():
             'count': len(formatted_questions)
         })
         
+    except SessionNotFound:
+        return jsonify({'error': 'Session not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -497,11 +1400,7 @@ def solve_quiz():
         session_id = data.get('sessionId')
         auto_submit = data.get('autoSubmit', False)
         
-        if session_id not in active_sessions:
-            return jsonify({'error': 'Session not found'}), 404
-        
-        bot = active_sessions[session_id]
-        results = bot.solve_quiz(auto_submit)
+        results = session_router.call(session_id, 'solve_quiz', auto_submit)
         
         answered_count = sum(1 for r in results if r.get('filled', False))
         
@@ -511,6 +1410,8 @@ def solve_quiz():
             'answeredQuestions': answered_count
         })
         
+    except SessionNotFound:
+        return jsonify({'error': 'Session not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -520,10 +1421,10 @@ def close_session():
         data = request.json
         session_id = data.get('sessionId')
         
-        if session_id in active_sessions:
-            bot = active_sessions[session_id]
-            bot.close()
-            del active_sessions[session_id]
+        try:
+            session_router.call(session_id, 'close')
+        except SessionNotFound:
+            pass
         
         return jsonify({'message': 'Session closed'})
         
@@ -531,6 +1432,14 @@ def close_session():
         return jsonify({'error': str(e)}), 500
 
 
+def start_background_services():
+    """Warm the browser pool and start listening for routed session calls"""
+    socketio.start_background_task(browser_pool.warm, config.data['headless'])
+    session_router.start()
+
+
 if __name__ == '__main__':
+    # Local development only; the container runs gunicorn (see gunicorn.conf.py)
     port = int(os.environ.get('PORT', 5000))
+    start_background_services()
     socketio.run(app, host='0.0.0.0', port=port, debug=False, allow_unsafe_werkzeug=True)
@@ -0,0 +1,15 @@
+import os
+
+# Socket.IO clients must stay on the worker that holds their connection, so
+# scale with threads here (and more containers behind a sticky load balancer)
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = 1
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 100))
+# solve-quiz requests wait on Groq and the browser for a while
+timeout = 300
+
+
+def post_worker_init(worker):
+    from app import start_background_services
+    start_background_services()